@@ -2,127 +2,252 @@
 2024, Noah Vandal
 Basic modules for a cli tool to assess arxiv papers published in the past day. 
 """
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import textwrap
+import time
+import httpx
 import re
+import xml.etree.ElementTree as ET
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-import PyPDF2
+import pymupdf
 import aisuite as ai
 from aisuite.provider import ProviderFactory
 import argparse
 
+# Namespace of the arXiv extensions in the RSS announcement feed
+ARXIV_NS = {'arxiv': 'http://arxiv.org/schemas/atom'}
+
+# Announcement types listed for a category, as on /recent: new submissions and cross-lists, not replacements
+ANNOUNCE_TYPES = {'new', 'cross'}
+
+DEFAULT_CACHE_PATH = "~/.arxiv_assessor_cache.db"
+
+# Leading slice of a PDF requested before falling back to the whole file
+PDF_PREFIX_BYTES = 256 * 1024
+# Most of any PDF read into memory, so concurrent downloads keep peak memory flat
+PDF_MAX_BYTES = 2 * 1024 * 1024
+# Written in place of a summary when neither the abstract nor the PDF yielded any text
+NO_TEXT_SUMMARY = "(No summary: no text could be extracted from the PDF)"
+# Written in place of a summary when fetching or summarizing a paper failed
+ERROR_SUMMARY = "(No summary: {error})"
+
+# Trailing version suffix on arXiv ids, e.g. the "v1" in 2411.18620v1
+_VERSION_RE = re.compile(r'v\d+$')
+# Runs of whitespace, including the hard line breaks in feed abstracts
+_WHITESPACE_RE = re.compile(r'\s+')
+# Header on RSS item descriptions, e.g. "arXiv:2411.18620v1 Announce Type: new \nAbstract: ..."
+_DESCRIPTION_PREFIX_RE = re.compile(r'^\s*arXiv:\S+\s+Announce Type:\s*\S+\s*(?:Abstract:\s*)?')
+# Outermost JSON array in a batched LLM reply, which may be wrapped in prose or code fences
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+# Wraps summary lines in the output file, configured once and reused for every paper.
+# Only breaks at whitespace, so URLs, hyphenated terms and long tokens stay intact.
+SUMMARY_WRAPPER = textwrap.TextWrapper(width=150, break_long_words=False, break_on_hyphens=False)
+
+class SummaryCache:
+    """
+    Persistent SQLite-backed store of paper summaries, so re-runs skip the download and LLM call
+    """
+    def __init__(self, path: str, expire: int = 30 * 86400):
+        self.expire = expire
+        self.conn = sqlite3.connect(Path(path).expanduser())
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries (key TEXT PRIMARY KEY, summary TEXT NOT NULL, created REAL NOT NULL)"
+        )
+    
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+    
+    def get(self, key: str) -> str:
+        """
+        Return the cached summary, or None if missing or expired
+        """
+        row = self.conn.execute("SELECT summary, created FROM summaries WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] > self.expire:
+            return None
+        return row[0]
+    
+    def set(self, key: str, summary: str):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (key, summary, time.time()))
+    
+    def close(self):
+        self.conn.close()
+
 class ArxivAssessor:
-    def __init__(self, subfolder: str, provider: str = "anthropic", model: str = "claude-3-sonnet", api_key: str = None):
+    def __init__(self, subfolder: str, provider: str = "anthropic", model: str = "claude-3-sonnet", api_key: str = None,
+                 cache_path: str = DEFAULT_CACHE_PATH, llm_rpm: int = 300):
         """
         Initialize the assessor with the arxiv subfolder to analyze
         (e.g., 'cs.AI' for Artificial Intelligence papers)
         """
         self.subfolder = subfolder
-        self.base_url = f"https://arxiv.org/list/{self.subfolder}/recent"
+        self.rss_url = f"https://rss.arxiv.org/rss/{self.subfolder}"
         self.provider = provider
         self.model = model
+        # aisuite's "provider:model" id, built once rather than per LLM call
+        self._model_id = f"{provider}:{model}"
+        self.temperature = 0.3
+        
+        # Summaries are effectively immutable, so keep them across runs (None disables caching)
+        self.cache = SummaryCache(cache_path) if cache_path else None
         
         # Initialize client with proper provider configuration
         provider_configs = {
             provider: {"api_key": api_key}
         } if api_key else {}
         self.client = ai.Client(provider_configs)
+        
+        # Cap in-flight LLM calls to roughly the provider's per-second rate limit
+        llm_concurrency = max(1, llm_rpm // 60)
+        self._llm_limit = asyncio.Semaphore(llm_concurrency)
+        # aisuite has no async client, so calls run on threads; a dedicated pool keeps
+        # the default executor's small size from capping them below the limit above
+        self._llm_executor = concurrent.futures.ThreadPoolExecutor(max_workers=llm_concurrency)
+        
+        # Shared HTTP/2 client, concurrent requests to arxiv.org multiplex over one connection
+        self.client_http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+            timeout=30.0,
+            follow_redirects=True,
+        )
+        
+        # PDF text extraction is CPU-bound and holds the GIL, so spread it across processes
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count())
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        await self.client_http.aclose()
+        self._pool.shutdown()
+        self._llm_executor.shutdown()
+        if self.cache:
+            self.cache.close()
     
-    def get_daily_papers(self) -> list:
+    async def _get(self, url: str, headers: dict = None, max_bytes: int = None,
+                   retries: int = 3, backoff_factor: float = 0.3) -> tuple:
         """
-        Scrape the arxiv subfolder and return list of papers from the most recent day
+        GET a url over the shared client, retrying transport errors and 5xx responses with backoff.
+        The body is streamed and reading stops once max_bytes have arrived.
+        Returns the response and the body bytes.
         """
+        for attempt in range(retries + 1):
+            try:
+                async with self.client_http.stream("GET", url, headers=headers) as response:
+                    if response.status_code < 500 or attempt == retries:
+                        response.raise_for_status()
+                        body = io.BytesIO()
+                        async for chunk in response.aiter_bytes(chunk_size=65536):
+                            body.write(chunk)
+                            if max_bytes and body.tell() >= max_bytes:
+                                break
+                        return response, body.getvalue()[:max_bytes]
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(backoff_factor * (2 ** attempt))
+    
+    async def get_daily_papers(self) -> list:
+        """
+        Return list of papers from the arxiv subfolder's most recent announcement
+        """
+        # The RSS feed lists exactly the latest announcement. Its submissions run from one 14:00 ET
+        # cutoff to the next (or over a whole weekend), so filtering on calendar dates can't recover it.
+        _, body = await self._get(self.rss_url)
+        channel = ET.fromstring(body).find('channel')
         papers = []
-        current_page = 0
-        
-        # Get the first page to find today's date
-        url = f"{self.base_url}"
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        # Find all date headers
-        date_headers = soup.find_all('h3', string=re.compile(r'\w+,\s+\d+\s+\w+\s+\d{4}'))
-        if not date_headers:
+        if channel is None:
             return papers
         
-        # Get today's date from the first header
-        today_match = re.search(r'(\w+,\s+\d+\s+\w+\s+\d{4})', date_headers[0].text)
-        if not today_match:
-            return papers
+        for item in channel.findall('item'):
+            if item.findtext('arxiv:announce_type', default='', namespaces=ARXIV_NS) not in ANNOUNCE_TYPES:
+                continue
+            # Links look like https://arxiv.org/abs/2411.18620
+            paper_id = _VERSION_RE.sub('', item.findtext('link', default='').split('/abs/')[-1])
+            # The description carries the abstract behind an id/announce-type header
+            abstract = _DESCRIPTION_PREFIX_RE.sub('', item.findtext('description', default=''))
+            papers.append({
+                'pdf_url': f"https://arxiv.org/pdf/{paper_id}",
+                'paper_id': paper_id,
+                'abstract': _WHITESPACE_RE.sub(' ', abstract).strip(),
+            })
         
-        today_date = datetime.strptime(today_match.group(1).strip(), '%a, %d %b %Y')
+        if not papers:
+            # arXiv doesn't announce on weekends and holidays, and the feed is empty then
+            print(f"No papers in the current {self.subfolder} announcement")
+            return papers
         
-        while True:
-            url = f"{self.base_url}?skip={current_page * 25}"
-            response = requests.get(url)
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
-            # Find the current section's date header
-            date_header = soup.find('h3', string=re.compile(r'\w+,\s+\d+\s+\w+\s+\d{4}'))
-            if date_header:
-                date_match = re.search(r'(\w+,\s+\d+\s+\w+\s+\d{4})', date_header.text)
-                if date_match:
-                    current_date = datetime.strptime(date_match.group(1).strip(), '%a, %d %b %Y')
-                    # Stop if we've moved to a different date
-                    if current_date != today_date:
-                        break
-            
-            # Get the dl element containing the papers
-            papers_list = soup.find('dl')
-            if not papers_list:
-                break
-                
-            new_papers = []
-            for dt in papers_list.find_all('dt'):
-                pdf_link = dt.find_next('a', title='Download PDF')
-                if pdf_link:
-                    new_papers.append({
-                        'pdf_url': f"https://arxiv.org{pdf_link['href']}",
-                        'paper_id': pdf_link['href'].split('/')[-1]
-                    })
-            
-            # If no new papers found, we've reached the end
-            if not new_papers:
-                break
-                
-            papers.extend(new_papers)
-            current_page += 1
-        
-        print(f"Found {len(papers)} papers in {self.subfolder} for {today_date.strftime('%Y-%m-%d')}")
+        pub_date = channel.findtext('pubDate')
+        announced = parsedate_to_datetime(pub_date).strftime('%Y-%m-%d') if pub_date else "the latest announcement"
+        print(f"Found {len(papers)} papers in {self.subfolder} for {announced}")
         return papers
 
-    def summarize_pdf(self, pdf_url: str) -> str:
+    async def _fetch_bytes(self, url: str, max_bytes: int = None) -> tuple:
+        """
+        Download a PDF, asking for only its first max_bytes when given and never reading more than PDF_MAX_BYTES.
+        Returns the raw bytes and whether they may be truncated (a 206 response or the cap was hit).
         """
-        Download PDF, extract text, and generate a concise summary
+        headers = {"Range": f"bytes=0-{max_bytes - 1}"} if max_bytes else None
+        response, data = await self._get(url, headers=headers, max_bytes=PDF_MAX_BYTES)
+        return data, response.status_code == 206 or len(data) >= PDF_MAX_BYTES
+
+    async def get_paper_text(self, paper: dict) -> str:
         """
-        # Download PDF
-        response = requests.get(pdf_url)
-        temp_pdf = Path("temp.pdf")
-        temp_pdf.write_bytes(response.content)
+        Return the paper's abstract, only downloading and parsing the PDF when no abstract is available
+        """
+        if paper.get('abstract'):
+            return paper['abstract']
         
-        try:
-            # Extract text from first few pages (abstract + intro usually sufficient)
-            text = ""
-            with open(temp_pdf, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                for page in reader.pages[:10]:  # First ten pages
-                    text += page.extract_text()
-        finally:
-            # Ensure file handle is closed before attempting deletion
-            try:
-                temp_pdf.unlink()
-            except PermissionError:
-                # If file is still locked, try again after a brief delay
-                import time
-                time.sleep(0.1)
-                temp_pdf.unlink()
+        # The abstract and intro almost always sit in the first few hundred KB of the file
+        pdf_bytes, partial = await self._fetch_bytes(paper['pdf_url'], max_bytes=PDF_PREFIX_BYTES)
+        text = await self._extract_text(paper, pdf_bytes)
         
-        # Generate summary
-        summary = self.summarize_text(text[:1024])
-        return summary
+        if partial and not text.strip():
+            # Retry without the Range header, still capped at PDF_MAX_BYTES
+            pdf_bytes, _ = await self._fetch_bytes(paper['pdf_url'])
+            text = await self._extract_text(paper, pdf_bytes)
+        return text
+
+    async def _extract_text(self, paper: dict, pdf_bytes: bytes) -> str:
+        """
+        Extract the PDF's text in a worker process, or "" if it can't be parsed
+        """
+        # Parse in a worker process so other papers' downloads keep flowing
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, _extract_text_from_bytes, pdf_bytes)
+        except Exception as e:
+            # Truncated or malformed, either way give up on this paper's text rather than the run
+            print(f"\nCould not parse PDF for paper {paper['paper_id']}: {e!r}")
+            return ""
 
-    def summarize_text(self, text: str) -> str:
+    def _cache_key(self, paper: dict) -> str:
+        # The key includes temperature since it changes what the model returns
+        return SummaryCache.key(self.provider, self.model, self.temperature, paper['paper_id'])
+
+    def get_cached_summary(self, paper: dict) -> str:
+        """
+        Return the cached summary for a paper, or None if it still needs summarizing
+        """
+        return self.cache.get(self._cache_key(paper)) if self.cache else None
+
+    def set_cached_summary(self, paper: dict, summary: str):
+        if self.cache:
+            self.cache.set(self._cache_key(paper), summary)
+
+    async def summarize_text(self, text: str) -> str:
         """
         Generate a concise summary using the specified LLM
         """
@@ -134,14 +259,180 @@ class ArxivAssessor:
             {"role": "user", "content": text},
         ]
         
-        response = self.client.chat.completions.create(
-            model=f"{self.provider}:{self.model}",
+        return await self._complete(messages, max_tokens=200)
+
+    async def _complete(self, messages: list, max_tokens: int) -> str:
+        """
+        Run one chat completion on the LLM thread pool and return the reply text
+        """
+        create = functools.partial(
+            self.client.chat.completions.create,
+            model=self._model_id,
             messages=messages,
-            temperature=0.3,
-            max_tokens=200,
+            temperature=self.temperature,
+            max_tokens=max_tokens,
         )
+        async with self._llm_limit:
+            response = await asyncio.get_running_loop().run_in_executor(self._llm_executor, create)
+
+        # Refusals and content filters can come back with no text at all
+        content = response.choices[0].message.content
+        if not isinstance(content, str):
+            raise ValueError(f"{self._model_id} returned no text content")
+        return content
+
+    async def summarize_texts(self, texts: list) -> list:
+        """
+        Summarize several papers with a single LLM call, returning summaries in the same order.
+        If the batch falls back to per-paper calls, failed papers are returned as their exception.
+        """
+        if len(texts) == 1:
+            return [await self.summarize_text(texts[0][:1024])]
+        
+        messages = [
+            {
+                "role": "system",
+                "content": "You are a scientific paper summarizer. You will be given several papers, each starting with a <<<PAPER i>>> delimiter. Create a very concise summary (5 sentences or less) of each paper. Focus on the main accomplishments and findings. Respond only with a JSON array of the form [{\"id\": i, \"summary\": \"...\"}], one object per paper.",
+            },
+            {"role": "user", "content": "\n\n".join(f"<<<PAPER {i}>>>\n{text[:800]}" for i, text in enumerate(texts))},
+        ]
         
-        return response.choices[0].message.content
+        try:
+            content = await self._complete(messages, max_tokens=200 * len(texts))
+            items = json.loads(_JSON_ARRAY_RE.search(content).group(0))
+            summaries = {int(item['id']): item['summary'] for item in items}
+            # A null or nested summary would break the cache and the writer further down
+            if not all(isinstance(summaries.get(i), str) for i in range(len(texts))):
+                raise ValueError("batched reply is missing a text summary")
+            return [summaries[i] for i in range(len(texts))]
+        except (AttributeError, ValueError, KeyError, TypeError):
+            # Fall back to one call per paper if the batched reply can't be parsed;
+            # a paper whose own call fails comes back as the exception
+            return list(await asyncio.gather(*(self.summarize_text(text[:1024]) for text in texts), return_exceptions=True))
+
+def _extract_text_from_bytes(data: bytes) -> str:
+    """
+    Extract text from the first few pages (abstract + intro usually sufficient).
+    Kept at module scope so it can be pickled into the process pool.
+    """
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        # First ten pages
+        return "".join(doc[i].get_text() for i in range(min(10, len(doc))))
+
+async def summarize_papers(assessor: ArxivAssessor, papers: list, queue: asyncio.Queue,
+                           concurrency: int = 8, batch_size: int = 10):
+    """
+    Summarize all papers concurrently, putting (index, summary) on the queue as each one is ready
+    """
+    # Bound the number of in-flight downloads to stay polite to arXiv
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    pending = []
+    for i, paper in enumerate(papers):
+        summary = assessor.get_cached_summary(paper)
+        if summary is None:
+            pending.append(i)
+        else:
+            queue.put_nowait((i, summary))
+    
+    def report_failure(i: int, error: Exception):
+        # Failures get a note but aren't cached, so a later run retries the paper
+        print(f"\nFailed to summarize paper {papers[i]['paper_id']}: {error!r}")
+        queue.put_nowait((i, ERROR_SUMMARY.format(error=error)))
+    
+    async def fetch_text(i: int) -> str:
+        """
+        Return the paper's text, or None once a failure has been reported for it
+        """
+        async with semaphore:
+            try:
+                return await assessor.get_paper_text(papers[i])
+            except Exception as e:
+                report_failure(i, e)
+                return None
+    
+    async def summarize_batch(indices: list):
+        # Each batch goes to the LLM as soon as its own texts are in, overlapping other batches' downloads
+        batch_texts = await asyncio.gather(*(fetch_text(i) for i in indices))
+        
+        # Papers with no readable text get a note instead of an LLM call, and stay uncached so a later run retries them
+        readable = []
+        for i, text in zip(indices, batch_texts):
+            if text is None:
+                continue
+            if text.strip():
+                readable.append((i, text))
+            else:
+                print(f"\nNo text could be extracted for paper {papers[i]['paper_id']}, skipping")
+                queue.put_nowait((i, NO_TEXT_SUMMARY))
+        if not readable:
+            return
+        indices = [i for i, _ in readable]
+        batch_texts = [text for _, text in readable]
+        
+        print(f"\nProcessing papers: {', '.join(papers[i]['paper_id'] for i in indices)}")
+        try:
+            batch_summaries = await assessor.summarize_texts(batch_texts)
+        except Exception as e:
+            for i in indices:
+                report_failure(i, e)
+            return
+        for i, summary in zip(indices, batch_summaries):
+            if isinstance(summary, Exception):
+                report_failure(i, summary)
+                continue
+            assessor.set_cached_summary(papers[i], summary)
+            queue.put_nowait((i, summary))
+    
+    # One LLM call per batch of papers amortizes the round trip and the shared prompt
+    tasks = [summarize_batch(pending[start:start + batch_size]) for start in range(0, len(pending), batch_size)]
+    await asyncio.gather(*tasks)
+
+def write_summary(f, paper: dict, summary: str):
+    """
+    Write one paper's entry to the output file and echo the summary to the console
+    """
+    f.write(f"Paper ID: {paper['paper_id']}\n")
+    f.write(f"URL: https://arxiv.org/abs/{paper['paper_id']}\n")
+    f.write(f"PDF: {paper['pdf_url']}\n")
+    f.write("\nSummary:\n")
+    
+    # Wrap each line separately so the model's paragraph breaks are kept
+    f.write("\n".join(SUMMARY_WRAPPER.fill(line) for line in summary.splitlines()))
+    
+    f.write("\n" + "-" * 80 + "\n\n")
+    # Flush so each entry is on disk as soon as it's ready rather than when the run ends
+    f.flush()
+    
+    # Also print to console
+    print("Summary saved.")
+    print(summary)
+    print("-" * 80)
+
+async def write_summaries(f, papers: list, queue: asyncio.Queue):
+    """
+    Single writer draining the queue, so entries land in the file in paper order however batches finish
+    """
+    ready = {}
+    next_index = 0
+    while next_index < len(papers):
+        i, summary = await queue.get()
+        ready[i] = summary
+        while next_index in ready:
+            write_summary(f, papers[next_index], ready.pop(next_index))
+            next_index += 1
+
+async def fetch_and_summarize(assessor: ArxivAssessor, f):
+    """
+    Fetch the latest announcement's papers and write their summaries to f, closing the shared HTTP client when done
+    """
+    async with assessor:
+        papers = await assessor.get_daily_papers()
+        queue = asyncio.Queue()
+        await asyncio.gather(
+            summarize_papers(assessor, papers, queue),
+            write_summaries(f, papers, queue),
+        )
 
 def main():
     parser = argparse.ArgumentParser(description='Assess recent arXiv papers from a specific subfolder')
@@ -149,6 +440,8 @@ def main():
     parser.add_argument('--provider', default='anthropic', help='AI provider (e.g., anthropic, openai)')
     parser.add_argument('--model', help='Model name (e.g., claude-3-sonnet, gpt-4)')
     parser.add_argument('--api-key', help='API key for the provider')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore and do not update the local summary cache')
+    parser.add_argument('--rpm', type=int, default=300, help='Requests per minute allowed by your provider tier')
     args = parser.parse_args()
     
     # Get supported providers from aisuite
@@ -176,9 +469,10 @@ def main():
             args.subfolder,
             provider=args.provider,
             model=model,
-            api_key=args.api_key
+            api_key=args.api_key,
+            cache_path=None if args.no_cache else DEFAULT_CACHE_PATH,
+            llm_rpm=args.rpm
         )
-        papers = assessor.get_daily_papers()
         
         # Create output filename with date
         today = datetime.now().strftime('%Y-%m-%d')
@@ -190,29 +484,7 @@ def main():
             f.write(f"ArXiv Summaries for {args.subfolder} on {today}\n")
             f.write("=" * 80 + "\n\n")
             
-            for paper in papers:
-                print(f"\nProcessing paper: {paper['paper_id']}")
-                summary = assessor.summarize_pdf(paper['pdf_url'])
-                # Write to file
-                f.write(f"Paper ID: {paper['paper_id']}\n")
-                f.write(f"URL: https://arxiv.org/abs/{paper['paper_id']}\n")
-                f.write(f"PDF: {paper['pdf_url']}\n")
-                f.write("\nSummary:\n")
-                
-                # Split summary into chunks of ~200 chars at whitespace
-                remaining = summary
-                while len(remaining) > 150:
-                    split_index = remaining[:150].rindex(' ')
-                    f.write(remaining[:split_index] + '\n')
-                    remaining = remaining[split_index+1:]   
-                f.write(remaining)
-                
-                f.write("\n" + "-" * 80 + "\n\n")
-                
-                # Also print to console
-                print("Summary saved.")
-                print(summary)
-                print("-" * 80)
+            asyncio.run(fetch_and_summarize(assessor, f))
         
         print(f"\nAll summaries have been saved to {output_file}")
             